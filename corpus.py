@@ -0,0 +1,46 @@
+import gzip
+import json
+import time
+
+# Corpus files are gzip-compressed JSONL: one record per line.
+# Each append opens the file in "at" mode which adds a new gzip member;
+# gzip.open() reads multi-member files transparently, so a crash mid-run
+# loses at most the record being written.
+#
+# Record layout:
+#   {"source": "gmail", "ts": <unix time>, "id": <message id>,
+#    "payload": <gmail message payload>, "expected": <txn or null>}
+#   {"source": "ntfy", "ts": <unix time>, "frame": <raw websocket frame>,
+#    "attachment": <attachment text or null>, "expected": <txn or null>}
+#
+# "expected" is what the live parser extracted at capture time
+# ({"amount": ..., "date": ..., "time": ...}) and is what replay checks against.
+
+def append_record(filename, record):
+    """Appends a single record to the corpus. Never raises; capture must not break the listener."""
+    if not filename:
+        return
+    record.setdefault("ts", time.time())
+    try:
+        with gzip.open(filename, "at", encoding="utf-8") as corpus_file:
+            corpus_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"ERROR: Failed to write capture record to {filename}: {e}")
+
+def read_records(filename):
+    """Yields records from a corpus file, skipping lines that are not valid JSON."""
+    with gzip.open(filename, "rt", encoding="utf-8") as corpus_file:
+        for line_number, line in enumerate(corpus_file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"WARNING: Skipping malformed corpus line {line_number} in {filename}: {e}")
+
+def expected_from_txn(txn):
+    """Reduces a parsed transaction to the fields replay compares."""
+    if not txn:
+        return None
+    return {"amount": txn["amount"], "date": txn["date"], "time": txn["time"]}
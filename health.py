@@ -0,0 +1,219 @@
+import asyncio
+import faulthandler
+import json
+import os
+import sys
+import threading
+import time
+
+import startup
+
+# --- Watchdog Configuration ---
+LOOP_LAG_INTERVAL_SECONDS = 1.0   # How often the event loop heartbeat runs
+LOOP_LAG_WARN_SECONDS = 0.5       # Lag above this marks the app as degraded
+LOOP_HANG_TIMEOUT_SECONDS = 30    # No heartbeat for this long means the loop is frozen
+HEALTH_PUBLISH_INTERVAL_SECONDS = 10
+
+STATUS_OK = "ok"
+STATUS_DEGRADED = "degraded"  # Working, but the event loop is lagging
+STATUS_DOWN = "down"          # A source is disconnected or has stopped making progress
+
+def restart_process(reason):
+    """Replaces the current process with a fresh copy of itself. Used when recovery in-process is not possible."""
+    print(f"ERROR: {reason}. Restarting process...")
+    sys.stdout.flush()
+    try:
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+    except Exception as e:
+        print(f"ERROR: Failed to re-exec process: {e}. Exiting so a supervisor can restart it.")
+        sys.stdout.flush()
+    os._exit(1)
+
+class HealthMonitor:
+    """
+    Watches the event loop and the sources feeding it.
+
+    - Loop lag: a heartbeat coroutine measures how late asyncio.sleep() wakes up.
+    - Loop hang: a thread restarts the process if the heartbeat stops entirely.
+    - Progress: each source reports progress and says when the next report is due;
+      a missed deadline calls the source's on_stall callback (default: restart).
+      The source stays down until it reports progress again, and if another full
+      interval passes without progress the process is restarted.
+
+    The combined state is pushed to on_state_change (the LED) when it changes and
+    written as JSON to metrics_file. WATCHDOG=1 is sent to systemd on every heartbeat,
+    so systemd only restarts a frozen process; upstream outages are left to the LED,
+    the metrics and the in-process recovery.
+    """
+
+    def __init__(self, metrics_file=None, on_state_change=None, on_fatal=None):
+        self.metrics_file = metrics_file
+        self.on_state_change = on_state_change
+        self.on_fatal = on_fatal
+        self.status = None
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+        self.recoveries = 0
+        self._heartbeat = None
+        self._stopped = threading.Event()
+        self._progress = {}   # name -> {"last", "within", "on_stall", "stalled_at", "stalls"}
+        self._progress_lock = threading.Lock() # report_progress() may be called from worker threads
+        self._connected = {}  # name -> bool
+        self._reconnects = {} # name -> count
+        self._ever_connected = set()
+
+    def report_progress(self, name, within_seconds, on_stall=None):
+        """Marks source `name` as alive and expects the next report within `within_seconds`. Thread-safe."""
+        with self._progress_lock:
+            entry = self._progress.setdefault(name, {"on_stall": None, "stalls": 0})
+            entry["last"] = time.monotonic()
+            entry["within"] = within_seconds
+            entry["stalled_at"] = None # Progress clears a stall
+            if on_stall is not None:
+                entry["on_stall"] = on_stall
+
+    def set_connected(self, name, connected):
+        """Sources should start out disconnected so the LED stays off until they are actually up."""
+        if connected and not self._connected.get(name) and name in self._ever_connected:
+            self._reconnects[name] = self._reconnects.get(name, 0) + 1
+        if connected:
+            self._ever_connected.add(name)
+        self._connected[name] = connected
+
+    def stop(self):
+        """Stops the hang watch, e.g. before a slow shutdown that would otherwise look like a hang."""
+        self._stopped.set()
+
+    def snapshot(self):
+        now = time.monotonic()
+        progress = {}
+        with self._progress_lock:
+            for name, entry in self._progress.items():
+                age = now - entry["last"]
+                stalled = entry["stalled_at"] is not None
+                progress[name] = {
+                    "age": round(age, 1),
+                    "within": entry["within"],
+                    "ok": age <= entry["within"] and not stalled,
+                    "stalled": stalled,
+                    "stalls": entry["stalls"], # Total since start
+                }
+        return {
+            "status": self.status,
+            "updated": time.time(),
+            "uptime": round(startup.seconds_since_start(), 1),
+            "loop_lag_ms": round(self.loop_lag * 1000, 1),
+            "max_loop_lag_ms": round(self.max_loop_lag * 1000, 1),
+            "connected": dict(self._connected),
+            "reconnects": dict(self._reconnects),
+            "progress": progress,
+            "recoveries": self.recoveries,
+        }
+
+    def _evaluate(self):
+        now = time.monotonic()
+        status = STATUS_OK
+        if self.loop_lag > LOOP_LAG_WARN_SECONDS:
+            status = STATUS_DEGRADED
+        if not all(self._connected.values()):
+            status = STATUS_DOWN
+
+        stalled = []
+        recovery_failed = None
+        with self._progress_lock:
+            for name, entry in self._progress.items():
+                if entry["stalled_at"] is not None:
+                    # Still stalled: stays down until the source reports progress again
+                    status = STATUS_DOWN
+                    if now - entry["stalled_at"] > entry["within"]:
+                        recovery_failed = name
+                    continue
+                if now - entry["last"] <= entry["within"]:
+                    continue
+                entry["stalled_at"] = now  # The recovery gets one full interval to restore progress
+                entry["stalls"] += 1
+                stalled.append((name, now - entry["last"], entry["within"], entry["on_stall"]))
+
+        if recovery_failed:
+            print(f"ERROR: {recovery_failed} made no progress after recovery.")
+            self._fatal(f"{recovery_failed} stalled after recovery") # Does not return
+
+        for name, silence, within, on_stall in stalled:
+            status = STATUS_DOWN
+            print(f"ERROR: {name} made no progress for {silence:.0f}s (expected within {within}s).")
+            self.recoveries += 1
+            if on_stall is None:
+                self._fatal(f"{name} stalled") # Does not return
+                continue
+            try:
+                on_stall()
+            except Exception as e:
+                print(f"ERROR: Recovery for {name} failed: {e}")
+        return status
+
+    def _set_status(self, status):
+        if status == self.status:
+            return False
+        print(f"INFO: Health status changed: {self.status} -> {status}")
+        self.status = status
+        if self.on_state_change:
+            try:
+                self.on_state_change(status)
+            except Exception as e:
+                print(f"ERROR: Failed to publish health state: {e}")
+        return True
+
+    def write_metrics(self):
+        if not self.metrics_file:
+            return
+        tmp_filename = f"{self.metrics_file}.tmp"
+        try:
+            with open(tmp_filename, "w") as metrics_file:
+                json.dump(self.snapshot(), metrics_file)
+            os.replace(tmp_filename, self.metrics_file) # Readers never see a partial file
+        except Exception as e:
+            print(f"ERROR: Failed to write health metrics to {self.metrics_file}: {e}")
+
+    def _fatal(self, reason):
+        self._set_status(STATUS_DOWN)
+        self.write_metrics()
+        if self.on_fatal:
+            try:
+                self.on_fatal(reason)
+            except Exception as e:
+                print(f"ERROR: on_fatal handler failed: {e}")
+        restart_process(reason)
+
+    def _watch_for_hang(self):
+        while not self._stopped.wait(LOOP_LAG_INTERVAL_SECONDS):
+            silence = time.monotonic() - self._heartbeat
+            if silence > LOOP_HANG_TIMEOUT_SECONDS:
+                print(f"ERROR: Event loop unresponsive for {silence:.0f}s. Stack traces follow.")
+                faulthandler.dump_traceback(all_threads=True)
+                self._fatal("event loop hung")
+
+    async def run(self):
+        """Runs until cancelled. Start it as a task next to the listener."""
+        self._heartbeat = time.monotonic()
+        threading.Thread(target=self._watch_for_hang, name="health-hang-watch", daemon=True).start()
+        last_publish = 0.0
+        try:
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+                self._heartbeat = time.monotonic()
+                self.loop_lag = max(0.0, self._heartbeat - started - LOOP_LAG_INTERVAL_SECONDS)
+                self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+                if self.loop_lag > LOOP_LAG_WARN_SECONDS:
+                    print(f"WARNING: Event loop lagged {self.loop_lag * 1000:.0f}ms.")
+
+                status = self._evaluate()
+                changed = self._set_status(status)
+                if "WATCHDOG_USEC" in os.environ:
+                    startup.sd_notify("WATCHDOG=1")
+                if changed or self._heartbeat - last_publish >= HEALTH_PUBLISH_INTERVAL_SECONDS:
+                    self.write_metrics()
+                    self.max_loop_lag = self.loop_lag
+                    last_publish = self._heartbeat
+        finally:
+            self.stop()
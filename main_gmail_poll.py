@@ -1,23 +1,24 @@
+import startup # Imported first so time-to-ready covers the whole startup
 import os
 import time
 import re
 import base64
 import signal
+import socket
+import threading
 # subprocess is no longer needed as get_local_ip is removed
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+# google-auth, googleapiclient, gTTS, playsound3 and requests are imported on first use
+# (and warmed up in the background by main()) to keep cold starts on the Pi fast.
 # InstalledAppFlow is no longer needed here
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from gtts import gTTS
-import playsound3 # For playing the audio
-
-import requests # for ntfy
 
 from datetime import datetime
 
 import asyncio
 
+import corpus
+import health
+import relay
+
 # Attempt to import RPi.GPIO and set up a flag
 try:
     import RPi.GPIO as GPIO
@@ -33,10 +34,32 @@ TOKEN_FILE = "google_token.json"
 CREDENTIALS_FILE = "google_credentials.json" # Still needed for client_id/client_secret if refresh token needs them
 AUDIO_FILENAME = "temp_speech.mp3"
 SAVE_CREDS_INTERVAL_SECONDS = 3600  # Save/Refresh credentials every 1 hour (was 10 seconds)
+NTFY_ALERTS_URL = 'https://ntfy.sh/ghoshika_alerts'
+NTFY_PUBLISH_TIMEOUT_SECONDS = 10
+
+# Imported concurrently in the background while the Gmail service is being built
+WARM_UP_MODULES = ("gtts", "playsound3", "requests")
+
+# --- Health Configuration ---
+HEALTH_METRICS_FILE = "health_gmail.json"
+GMAIL_HTTP_TIMEOUT_SECONDS = 20  # Default socket timeout so a dead connection can't wedge a poll forever
+POLL_PROGRESS_GRACE_SECONDS = 120  # Time a poll or a single alert (TTS, playback, API calls) may take before the poller is considered stuck
+POLL_FAILURES_BEFORE_DOWN = 3  # Consecutive failed polls before gmail is reported down (rides out Wi-Fi blips)
 
 TARGET_SENDER = "transaction.alerts@idfcfirstbank.com"
 TARGET_SUBJECT = "Transaction alert from IDFC FIRST Bank"
 SEARCH_TEXT_PATTERN = r"has been credited with INR\s*([0-9,]+\.?[0-9]{0,2})\s+on\s+(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2})"
+SEARCH_TEXT_REGEX = re.compile(SEARCH_TEXT_PATTERN, re.IGNORECASE)
+
+# --- Capture Configuration ---
+# Set GHOSHIKA_CAPTURE_FILE (e.g. corpus_gmail.jsonl.gz) to record every fetched
+# message payload for later use with replay_corpus.py.
+CAPTURE_CORPUS_FILE = os.environ.get("GHOSHIKA_CAPTURE_FILE")
+
+# --- Relay Configuration ---
+# Set GHOSHIKA_RELAY_HUB_PORT (e.g. 8765) to also broadcast parsed transactions to
+# speaker nodes running main_speaker.py on the LAN.
+relay_hub = relay.hub_from_env()
 
 # --- GPIO Configuration ---
 LED_GPIO_PIN = 17  # BCM Pin number for the LED
@@ -94,21 +117,24 @@ def blink_led_sync(times=3, on_duration=0.15, off_duration=0.15):
 
 # get_local_ip function is removed as it's no longer needed for OAuth flow here.
 
-def speak_text(text_to_speak):
+def speak_text(text_to_speak, audio_filename=AUDIO_FILENAME, alert_on_failure=True):
     try:
         print(f"Attempting to speak: \"{text_to_speak}\"")
+        from gtts import gTTS
+        import playsound3 # For playing the audio
         tts = gTTS(text=text_to_speak, lang='en', slow=False)
-        tts.save(AUDIO_FILENAME)
-        playsound3.playsound(AUDIO_FILENAME)
+        tts.save(audio_filename)
+        playsound3.playsound(audio_filename)
     except Exception as e:
         print(f"Error in text-to-speech or playback: {e}")
-        ntfy_publish('Failed to speak', 5)
+        if alert_on_failure:
+            ntfy_publish('Failed to speak', 5)
     finally:
-        if os.path.exists(AUDIO_FILENAME):
+        if os.path.exists(audio_filename):
             try:
-                os.remove(AUDIO_FILENAME)
+                os.remove(audio_filename)
             except Exception as e:
-                print(f"Error deleting temporary audio file {AUDIO_FILENAME}: {e}")
+                print(f"Error deleting temporary audio file {audio_filename}: {e}")
 
 def save_credentials_to_file(credentials, filename):
     try:
@@ -138,6 +164,7 @@ def refresh_gmail_creds(creds):
         #     else:
         #         print(f"WARNING: {CREDENTIALS_FILE} not found, which might be needed for refresh if token.json is incomplete.")
 
+        from google.auth.transport.requests import Request
         creds.refresh(Request())
         print("INFO: Credentials refreshed successfully.")
         save_credentials_to_file(creds, TOKEN_FILE)
@@ -153,6 +180,10 @@ def get_gmail_service():
     Loads credentials from token.json, refreshes if necessary, and builds the Gmail service.
     Assumes token.json is generated by google_auth_gen.py.
     """
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+
     creds = None
     if not os.path.exists(TOKEN_FILE):
         print(f"ERROR: Token file '{TOKEN_FILE}' not found.")
@@ -207,7 +238,23 @@ def get_email_body(message_payload):
             return base64.urlsafe_b64decode(message_payload["body"]["data"]).decode("utf-8")
     return None
 
+def parse_transaction(email_body_text):
+    """Extracts the credited amount and timing from an alert body. Returns a dict or None."""
+    match = SEARCH_TEXT_REGEX.search(email_body_text)
+    if not match:
+        return None
+    return {
+        "amount": match.group(1),
+        "sum": match.group(1).replace(",", "").replace(".00", ""),
+        "date": match.group(2),
+        "time": match.group(3),
+    }
+
+def speech_message_for(txn):
+    return f"Rupees. {txn['sum']}. received."
+
 def process_email(service, message_id):
+    from googleapiclient.errors import HttpError
     try:
         msg = (
             service.users()
@@ -221,17 +268,23 @@ def process_email(service, message_id):
             return
 
         email_body_text = get_email_body(payload)
+        txn = parse_transaction(email_body_text) if email_body_text else None
+        if CAPTURE_CORPUS_FILE:
+            corpus.append_record(CAPTURE_CORPUS_FILE, {
+                "source": "gmail",
+                "id": message_id,
+                "payload": payload,
+                "expected": corpus.expected_from_txn(txn),
+            })
+
         if email_body_text:
-            match = re.search(SEARCH_TEXT_PATTERN, email_body_text, re.IGNORECASE)
-            if match:
-                extracted_sum = match.group(1).replace(",", "").replace(".00", "")
-                transaction_date = match.group(2)
-                transaction_time = match.group(3)
-                
-                print_message = f"Transaction Alert: Credited amount = INR {match.group(1)} on {transaction_date} at {transaction_time}"
+            if txn:
+                print_message = f"Transaction Alert: Credited amount = INR {txn['amount']} on {txn['date']} at {txn['time']}"
                 print(print_message)
 
-                speech_message = f"Rupees. {extracted_sum}. received."
+                speech_message = speech_message_for(txn)
+                if relay_hub:
+                    relay_hub.publish(txn, speech_message) # Before speaking so speakers announce together with the hub
                 speak_text(speech_message)
                 ntfy_publish(speech_message, 4)
                 blink_led_sync()
@@ -249,6 +302,7 @@ def process_email(service, message_id):
         print(f"An unexpected error occurred with email ID {message_id}: {e}")
 
 def mark_email_as_read(service, message_id):
+    from googleapiclient.errors import HttpError
     try:
         service.users().messages().modify(
             userId="me", id=message_id, body={"removeLabelIds": ["UNREAD"]}
@@ -256,7 +310,13 @@ def mark_email_as_read(service, message_id):
     except HttpError as error:
         print(f"An error occurred while marking email ID {message_id} as read: {error}")
 
-def check_new_emails(service):
+def check_new_emails(service, on_progress=None):
+    """
+    Processes all unread alerts. Returns True if the poll succeeded.
+    on_progress() is called once the list comes back and after every processed alert,
+    so a long backlog isn't mistaken for a stuck poller.
+    """
+    from googleapiclient.errors import HttpError
     try:
         query = f"is:unread from:{TARGET_SENDER} subject:\"{TARGET_SUBJECT}\" in:inbox"
         response = (
@@ -266,32 +326,70 @@ def check_new_emails(service):
             .execute()
         )
         messages = response.get("messages", [])
+        if on_progress:
+            on_progress()
         if not messages:
             pass
         else:
             print(f"Found {len(messages)} new transaction alert email(s).")
             for message_summary in messages:
                 process_email(service, message_summary["id"])
+                if on_progress:
+                    on_progress()
+        return True
     except HttpError as error:
         print(f"An error occurred while checking for new emails: {error}")
         if error.resp.status == 401:
             print("ERROR: Received 401 Unauthorized while checking emails. Credentials may be invalid or revoked.")
     except Exception as e:
         print(f"An unexpected error occurred while checking emails: {e}")
+    return False
+
 
+_ntfy_session = None
+_ntfy_session_lock = threading.Lock()
+
+def get_ntfy_session():
+    # A shared session keeps the TLS connection to ntfy.sh pooled between alerts
+    global _ntfy_session
+    with _ntfy_session_lock: # Startup publish and the first alert may race here
+        if _ntfy_session is None:
+            import requests # for ntfy
+            _ntfy_session = requests.Session()
+        return _ntfy_session
 
 # priority: 1 - 5(max)
 def ntfy_publish(message, priority=1):
     try: 
-        requests.post(
-            'https://ntfy.sh/ghoshika_alerts',
+        get_ntfy_session().post(
+            NTFY_ALERTS_URL,
             data=message.encode(encoding='utf-8'),
             headers={
                 'p': str(priority)
-            }   
+            },
+            timeout=NTFY_PUBLISH_TIMEOUT_SECONDS
         )
     except Exception as e:
-        printf(f'Failed to send ntfy alert: {e}')
+        print(f'Failed to send ntfy alert: {e}')
+
+def ntfy_publish_async(message, priority=1):
+    """Publishes without blocking the caller. Not for shutdown alerts, the thread dies with the process."""
+    startup.run_in_background(ntfy_publish, message, priority, name="ntfy-publish")
+
+def show_health_on_led(status):
+    if status == health.STATUS_DOWN:
+        led_off()
+    else:
+        led_on()
+
+def alert_before_restart(reason):
+    ntfy_publish(f'APP RESTARTING: {reason}', 5)
+
+health_monitor = health.HealthMonitor(
+    metrics_file=HEALTH_METRICS_FILE,
+    on_state_change=show_health_on_led,
+    on_fatal=alert_before_restart,
+)
     
 
 crash_alert_enabled = True
@@ -303,8 +401,9 @@ async def main_task():
         return
 
     setup_gpio()
+    socket.setdefaulttimeout(GMAIL_HTTP_TIMEOUT_SECONDS)
 
-    service, creds = get_gmail_service()
+    service, creds = await asyncio.to_thread(get_gmail_service)
     if not service or not creds:
         print("Failed to initialize Gmail service or obtain credentials. Exiting.")
         led_off()
@@ -313,11 +412,18 @@ async def main_task():
 
     print("Starting email listener with voice alerts...")
     led_on()
+    health_monitor.set_connected("gmail", True)
+    startup.mark_ready("gmail")
     print(f"Looking for emails from: {TARGET_SENDER}")
     print(f"With subject: {TARGET_SUBJECT}")
     print(f"Searching for text pattern: \"{SEARCH_TEXT_PATTERN}\"")
 
     last_creds_save_time = time.time()
+    consecutive_poll_failures = 0
+
+    def report_poll_progress():
+        # Called from the poll's worker thread
+        health_monitor.report_progress("gmail", 5 + POLL_PROGRESS_GRACE_SECONDS)
 
     try:
         while True:
@@ -325,13 +431,15 @@ async def main_task():
             if not creds or not creds.valid:
                 print("WARNING: Credentials became invalid. Attempting to refresh/re-acquire.")
                 led_off()
-                service, creds = get_gmail_service()
+                health_monitor.set_connected("gmail", False)
+                service, creds = await asyncio.to_thread(get_gmail_service)
                 if not service or not creds:
                     print("ERROR: Failed to re-initialize Gmail service after credentials became invalid. Stopping.")
                     break
                 else:
                     print("INFO: Successfully re-initialized service and credentials.")
                     led_on()
+                    health_monitor.set_connected("gmail", True)
                     last_creds_save_time = time.time() # Reset timer
 
             # refresh creds if needed
@@ -339,10 +447,11 @@ async def main_task():
             if (current_time - last_creds_save_time) > SAVE_CREDS_INTERVAL_SECONDS:
                 if creds and creds.valid and creds.refresh_token: # Only try to refresh if we have a refresh token
                     print(f"INFO: Scheduled time to refresh credentials. Next refresh in approx. {SAVE_CREDS_INTERVAL_SECONDS/3600.0:.2f} hour(s).")
-                    refreshed_creds = refresh_gmail_creds(creds)
+                    refreshed_creds = await asyncio.to_thread(refresh_gmail_creds, creds)
                     if refreshed_creds:
                         creds = refreshed_creds
                         try:
+                            from googleapiclient.discovery import build
                             service = build("gmail", "v1", credentials=creds) # Rebuild service with new creds
                             print("INFO: Gmail service rebuilt with refreshed credentials.")
                         except Exception as e_build:
@@ -364,11 +473,16 @@ async def main_task():
 
             hour = datetime.now().hour
  
+            # Runs in a worker thread so the event loop (and the health watchdog) stays responsive
             if hour >= 8 and hour <= 23:
-                check_new_emails(service)
+                poll_ok = await asyncio.to_thread(check_new_emails, service, report_poll_progress)
+                consecutive_poll_failures = 0 if poll_ok else consecutive_poll_failures + 1
+                health_monitor.set_connected("gmail", consecutive_poll_failures < POLL_FAILURES_BEFORE_DOWN)
+                report_poll_progress()
                 await asyncio.sleep(5)
             else:
                 print('shop closed. sleep for 15 minutes')
+                health_monitor.report_progress("gmail", 900 + POLL_PROGRESS_GRACE_SECONDS)
                 await asyncio.sleep(900) # sleep for 15 minutes 
     except Exception as e:
         print(f"Unhandled exception in main loop: {e}")
@@ -388,6 +502,12 @@ async def main_task():
 async def main():
     crash_alert_enabled = True
 
+    startup.warm_up(*WARM_UP_MODULES)
+    ntfy_publish_async('App started', 1) # Also opens the pooled ntfy connection
+
+    health_monitor.set_connected("gmail", False)
+    health_task = asyncio.create_task(health_monitor.run())
+    relay_task = asyncio.create_task(relay_hub.serve()) if relay_hub else None
     mt = asyncio.create_task(main_task())
 
     try:
@@ -395,11 +515,15 @@ async def main():
     except asyncio.CancelledError:
         print("received termination signal. shut down.")
         crash_alert_enabled = False
+    finally:
+        health_monitor.stop()
+        health_task.cancel()
+        if relay_task:
+            relay_task.cancel()
 
     if crash_alert_enabled:
         ntfy_publish('APP CRASHED', 5)
 
-ntfy_publish('App started', 1)
 if __name__ == "__main__":
     asyncio.run(main())
     
@@ -1,13 +1,18 @@
+import startup # Imported first so time-to-ready covers the whole startup
 import asyncio
 import websockets
 import json
 import re
 import os
 import signal
-import requests # For fetching attachment content
 import socket # For socket.gaierror
-from gtts import gTTS
-import playsound3 # For playing the audio
+import threading
+# requests, gTTS and playsound3 are imported on first use (and warmed up in the
+# background at startup) so the websocket can connect without waiting on them.
+
+import corpus
+import health
+import relay
 
 # Attempt to import RPi.GPIO and set up a flag
 try:
@@ -22,12 +27,36 @@ NTFY_SERVER_HOST = "ntfy.sh"
 NTFY_TOPIC = "ghoshika"
 NTFY_WEBSOCKET_URL = f"wss://{NTFY_SERVER_HOST}/{NTFY_TOPIC}/ws"
 
+# Keepalive: a ping every PING_INTERVAL, and the connection is dropped (and reopened)
+# if its pong doesn't arrive within PING_TIMEOUT. This catches half-open TCP after Wi-Fi drops.
+WEBSOCKET_PING_INTERVAL_SECONDS = 10
+WEBSOCKET_PING_TIMEOUT_SECONDS = 5
+WEBSOCKET_OPEN_TIMEOUT_SECONDS = 10
+# ntfy sends a keepalive event every ~45s; no frame at all for this long forces a reconnect
+NTFY_IDLE_TIMEOUT_SECONDS = 120
+HEALTH_METRICS_FILE = "health_ntfy.json"
+
 TARGET_NTFY_TITLE = "Transaction alert from IDFC FIRST Bank"
 TARGET_ATTACHMENT_NAME = "attachment.txt"
 
 SEARCH_TEXT_PATTERN = r"has been credited with INR\s*([0-9,]+\.?[0-9]{0,2})\s+on\s+(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2})"
+SEARCH_TEXT_REGEX = re.compile(SEARCH_TEXT_PATTERN, re.IGNORECASE)
 AUDIO_FILENAME = "temp_speech_ntfy.mp3"
 
+# Imported concurrently in the background while the websocket connects
+# (requests is warmed by warm_ntfy_session, which also opens the pooled connection)
+WARM_UP_MODULES = ("gtts", "playsound3")
+
+# --- Capture Configuration ---
+# Set GHOSHIKA_CAPTURE_FILE (e.g. corpus_ntfy.jsonl.gz) to record every websocket
+# frame and fetched attachment for later use with replay_corpus.py.
+CAPTURE_CORPUS_FILE = os.environ.get("GHOSHIKA_CAPTURE_FILE")
+
+# --- Relay Configuration ---
+# Set GHOSHIKA_RELAY_HUB_PORT (e.g. 8765) to also broadcast parsed transactions to
+# speaker nodes running main_speaker.py on the LAN.
+relay_hub = relay.hub_from_env()
+
 # --- GPIO Configuration ---
 LED_GPIO_PIN = 17  # BCM Pin number for the LED
 
@@ -89,41 +118,101 @@ async def blink_led(times=3, on_duration=0.15, off_duration=0.15):
 
 
 # --- Text-to-Speech Function ---
-def speak_text(text_to_speak):
+def speak_text(text_to_speak, audio_filename=AUDIO_FILENAME):
     try:
         print(f"Attempting to speak: \"{text_to_speak}\"")
+        from gtts import gTTS
+        import playsound3 # For playing the audio
         tts = gTTS(text=text_to_speak, lang='en', slow=False)
-        tts.save(AUDIO_FILENAME)
-        playsound3.playsound(AUDIO_FILENAME)
+        tts.save(audio_filename)
+        playsound3.playsound(audio_filename)
     except Exception as e:
         print(f"Error in text-to-speech or playback: {e}")
     finally:
-        if os.path.exists(AUDIO_FILENAME):
+        if os.path.exists(audio_filename):
             try:
-                os.remove(AUDIO_FILENAME)
+                os.remove(audio_filename)
             except Exception as e:
-                print(f"Error deleting temporary audio file {AUDIO_FILENAME}: {e}")
+                print(f"Error deleting temporary audio file {audio_filename}: {e}")
 
 # --- ntfy Message Processing ---
-async def process_transaction_alert(attachment_content):
-    match = re.search(SEARCH_TEXT_PATTERN, attachment_content, re.IGNORECASE)
-    if match:
-        raw_amount = match.group(1)
-        extracted_sum_for_speech = raw_amount.replace(",", "")
-        transaction_date = match.group(2)
-        transaction_time = match.group(3)
+def parse_transaction(attachment_content):
+    """Extracts the credited amount and timing from an alert attachment. Returns a dict or None."""
+    match = SEARCH_TEXT_REGEX.search(attachment_content)
+    if not match:
+        return None
+    return {
+        "amount": match.group(1),
+        "sum": match.group(1).replace(",", ""),
+        "date": match.group(2),
+        "time": match.group(3),
+    }
+
+def speech_message_for(txn):
+    return f"Rupees {txn['sum']} received."
 
+_ntfy_session = None
+_ntfy_session_lock = threading.Lock()
+
+def get_ntfy_session():
+    # A shared session keeps the TLS connection to ntfy.sh pooled between attachment fetches
+    global _ntfy_session
+    with _ntfy_session_lock: # The warm-up thread and the first fetch may race here
+        if _ntfy_session is None:
+            import requests # For fetching attachment content
+            _ntfy_session = requests.Session()
+        return _ntfy_session
+
+def warm_ntfy_session():
+    """Opens the pooled connection to the ntfy server so the first attachment fetch skips the TLS handshake."""
+    try:
+        get_ntfy_session().head(f"https://{NTFY_SERVER_HOST}/", timeout=10)
+        print(f"INFO: HTTP connection to {NTFY_SERVER_HOST} warmed up.")
+    except Exception as e:
+        print(f"WARNING: Failed to warm up HTTP connection to {NTFY_SERVER_HOST}: {e}")
+
+def is_alert_message(message):
+    """True if a decoded ntfy frame is a message with the transaction alert title."""
+    return message.get("event") == "message" and message.get("title") == TARGET_NTFY_TITLE
+
+def get_transaction_attachment(message):
+    """Returns the attachment info of a transaction alert frame, or None if it isn't one."""
+    if not is_alert_message(message):
+        return None
+    attachment_info = message.get("attachment")
+    if not attachment_info or attachment_info.get("name") != TARGET_ATTACHMENT_NAME:
+        return None
+    return attachment_info
+
+async def process_transaction_alert(attachment_content):
+    """Announces the transaction in the attachment. Returns the parsed transaction or None."""
+    txn = parse_transaction(attachment_content)
+    if txn:
         print_message = (
-            f"Transaction Alert (from ntfy): Credited amount = INR {raw_amount} "
-            f"on {transaction_date} at {transaction_time}"
+            f"Transaction Alert (from ntfy): Credited amount = INR {txn['amount']} "
+            f"on {txn['date']} at {txn['time']}"
         )
         print(print_message)
 
-        speech_message = f"Rupees {extracted_sum_for_speech} received."
-        speak_text(speech_message)
+        speech_message = speech_message_for(txn)
+        if relay_hub:
+            relay_hub.publish(txn, speech_message) # Before speaking so speakers announce together with the hub
+        await asyncio.to_thread(speak_text, speech_message) # Keeps the loop free to answer pings
         await blink_led() # Blink LED after successful processing and speech
     else:
         print(f"Pattern not found in ntfy attachment content:\n---\n{attachment_content[:200]}...\n---")
+    return txn
+
+def show_health_on_led(status):
+    if status == health.STATUS_DOWN:
+        led_off()
+    else:
+        led_on()
+
+health_monitor = health.HealthMonitor(
+    metrics_file=HEALTH_METRICS_FILE,
+    on_state_change=show_health_on_led,
+)
 
 async def ntfy_listener():
     print(f"Connecting to ntfy.sh WebSocket: {NTFY_WEBSOCKET_URL}")
@@ -149,24 +238,44 @@ async def ntfy_listener():
     for sig in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig, signal_handler)
 
+    health_monitor.set_connected("ntfy", False)
+    health_task = asyncio.create_task(health_monitor.run())
+    relay_task = asyncio.create_task(relay_hub.serve()) if relay_hub else None
+    websocket = None
+
+    def force_reconnect():
+        # Called by the health monitor when no frame has arrived for NTFY_IDLE_TIMEOUT_SECONDS
+        if websocket is not None:
+            print("WARNING: ntfy connection idle for too long. Forcing reconnect...")
+            asyncio.ensure_future(websocket.close())
+
     while running:
         # led_on() # Attempt to turn LED ON indicating an active connection attempt or state
+        health_monitor.report_progress("ntfy", NTFY_IDLE_TIMEOUT_SECONDS, on_stall=force_reconnect)
         try:
-            async with websockets.connect(NTFY_WEBSOCKET_URL) as websocket:
+            async with websockets.connect(
+                NTFY_WEBSOCKET_URL,
+                ping_interval=WEBSOCKET_PING_INTERVAL_SECONDS,
+                ping_timeout=WEBSOCKET_PING_TIMEOUT_SECONDS,
+                open_timeout=WEBSOCKET_OPEN_TIMEOUT_SECONDS,
+            ) as websocket:
                 print(f"Successfully connected to {NTFY_WEBSOCKET_URL}. LED ON.")
                 led_on() # Ensure LED is on after successful connection
+                health_monitor.set_connected("ntfy", True)
+                startup.mark_ready("ntfy")
                 async for message_json in websocket:
+                    health_monitor.report_progress("ntfy", NTFY_IDLE_TIMEOUT_SECONDS)
+                    attachment_content = None
+                    txn = None
                     try:
                         message = json.loads(message_json)
                         # print(f"Received ntfy message: {message}") # For debugging all messages
 
-                        if message.get("event") == "message" and \
-                           message.get("title") == TARGET_NTFY_TITLE:
-                            
+                        if is_alert_message(message):
                             print(f"Received relevant ntfy message: {message}")
 
-                            attachment_info = message.get("attachment")
-                            if attachment_info and attachment_info.get("name") == TARGET_ATTACHMENT_NAME:
+                            attachment_info = get_transaction_attachment(message)
+                            if attachment_info:
                                 attachment_url = attachment_info.get("url")
                                 if not attachment_url:
                                     print(f"Error: Attachment '{TARGET_ATTACHMENT_NAME}' found but no URL provided.")
@@ -179,13 +288,14 @@ async def ntfy_listener():
                                         print(f"Warning: Attachment URL '{attachment_url}' might be malformed. Trying as is.")
 
                                 print(f"Found matching notification with attachment. Fetching: {attachment_url}")
+                                import requests # For fetching attachment content
                                 try:
-                                    response = requests.get(attachment_url, timeout=10)
+                                    response = await asyncio.to_thread(get_ntfy_session().get, attachment_url, timeout=10)
                                     response.raise_for_status()
                                     attachment_content = response.text
                                     
                                     print(f"Successfully fetched attachment '{TARGET_ATTACHMENT_NAME}'. Processing...")
-                                    await process_transaction_alert(attachment_content)
+                                    txn = await process_transaction_alert(attachment_content)
 
                                 except requests.exceptions.RequestException as req_err:
                                     print(f"Error fetching attachment from {attachment_url}: {req_err}")
@@ -200,6 +310,14 @@ async def ntfy_listener():
                         print(f"Error decoding JSON from ntfy: {message_json}")
                     except Exception as e:
                         print(f"Error processing ntfy message: {e}")
+                    finally:
+                        if CAPTURE_CORPUS_FILE:
+                            corpus.append_record(CAPTURE_CORPUS_FILE, {
+                                "source": "ntfy",
+                                "frame": message_json,
+                                "attachment": attachment_content,
+                                "expected": corpus.expected_from_txn(txn),
+                            })
         
         except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK) as e:
             print(f"WebSocket connection closed: {e}. LED OFF. Reconnecting in 5 seconds...")
@@ -218,11 +336,20 @@ async def ntfy_listener():
         except Exception as e:
             print(f"An unexpected WebSocket error occurred: {e}. LED OFF. Reconnecting in 5 seconds...")
             led_off()
+        finally:
+            websocket = None
+            health_monitor.set_connected("ntfy", False)
         
         await asyncio.sleep(5)
 
+    health_task.cancel()
+    if relay_task:
+        relay_task.cancel()
+
 # --- Main Execution ---
 if __name__ == "__main__":
+    startup.warm_up(*WARM_UP_MODULES)
+    startup.run_in_background(warm_ntfy_session, name="warm-ntfy-session")
     setup_gpio()
     try:
         asyncio.run(ntfy_listener())
@@ -230,6 +357,7 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Unhandled exception in main: {e}")
     finally:
+        health_monitor.stop()
         print("INFO: Shutting down. Turning LED OFF and cleaning up resources.")
         led_off() # Ensure LED is off before cleanup
         cleanup_gpio()
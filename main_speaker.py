@@ -0,0 +1,167 @@
+import startup # Imported first so time-to-ready covers the whole startup
+import asyncio
+import os
+import signal
+# gTTS and playsound3 are imported on first use (and warmed up in the background at startup).
+
+import health
+import relay
+
+# Attempt to import RPi.GPIO and set up a flag
+try:
+    import RPi.GPIO as GPIO
+    HAS_GPIO = True
+except (ImportError, RuntimeError):
+    HAS_GPIO = False
+    print("WARNING: RPi.GPIO library not found or not usable. LED functionality will be disabled.")
+
+# --- Configuration ---
+# Thin speaker node: announces transactions relayed by a hub running
+# main_gmail_poll.py or main_ntfy_pub_sub.py with GHOSHIKA_RELAY_HUB_PORT set.
+RELAY_HUB_URL = os.environ.get("GHOSHIKA_RELAY_HUB_URL") # e.g. ws://192.168.1.10:8765, required
+SPEAKER_STATE_FILE = "speaker_state.json" # Last epoch/seq heard, for catch-up after a restart
+AUDIO_FILENAME = "temp_speech_speaker.mp3"
+HEALTH_METRICS_FILE = "health_speaker.json"
+
+# Imported concurrently in the background while connecting to the hub
+WARM_UP_MODULES = ("gtts", "playsound3")
+
+# --- GPIO Configuration ---
+LED_GPIO_PIN = 17  # BCM Pin number for the LED
+
+def setup_gpio():
+    if not HAS_GPIO:
+        return
+    try:
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(LED_GPIO_PIN, GPIO.OUT)
+        GPIO.output(LED_GPIO_PIN, GPIO.LOW)  # Start with LED OFF
+        print(f"INFO: GPIO {LED_GPIO_PIN} setup for LED.")
+    except Exception as e:
+        print(f"ERROR: Failed to setup GPIO: {e}. LED functionality may be affected.")
+
+def cleanup_gpio():
+    if not HAS_GPIO:
+        return
+    try:
+        print("INFO: Cleaning up GPIO...")
+        GPIO.output(LED_GPIO_PIN, GPIO.LOW)  # Turn LED OFF
+        GPIO.cleanup()
+        print("INFO: GPIO cleanup complete.")
+    except Exception as e:
+        print(f"ERROR: Failed to cleanup GPIO: {e}")
+
+def led_on():
+    if not HAS_GPIO:
+        return
+    try:
+        GPIO.output(LED_GPIO_PIN, GPIO.HIGH)
+    except Exception as e:
+        print(f"ERROR: Failed to turn LED ON: {e}")
+
+def led_off():
+    if not HAS_GPIO:
+        return
+    try:
+        GPIO.output(LED_GPIO_PIN, GPIO.LOW)
+    except Exception as e:
+        print(f"ERROR: Failed to turn LED OFF: {e}")
+
+async def blink_led(times=3, on_duration=0.15, off_duration=0.15):
+    if not HAS_GPIO:
+        return
+    try:
+        for _ in range(times):
+            GPIO.output(LED_GPIO_PIN, GPIO.HIGH)
+            await asyncio.sleep(on_duration)
+            GPIO.output(LED_GPIO_PIN, GPIO.LOW)
+            await asyncio.sleep(off_duration)
+        GPIO.output(LED_GPIO_PIN, GPIO.HIGH)  # Ensure LED is ON after blinking (if connection is active)
+    except Exception as e:
+        print(f"ERROR: Failed to blink LED: {e}")
+
+# --- Text-to-Speech Function ---
+def speak_text(text_to_speak):
+    try:
+        print(f"Attempting to speak: \"{text_to_speak}\"")
+        from gtts import gTTS
+        import playsound3 # For playing the audio
+        tts = gTTS(text=text_to_speak, lang='en', slow=False)
+        tts.save(AUDIO_FILENAME)
+        playsound3.playsound(AUDIO_FILENAME)
+    except Exception as e:
+        print(f"Error in text-to-speech or playback: {e}")
+    finally:
+        if os.path.exists(AUDIO_FILENAME):
+            try:
+                os.remove(AUDIO_FILENAME)
+            except Exception as e:
+                print(f"Error deleting temporary audio file {AUDIO_FILENAME}: {e}")
+
+def show_health_on_led(status):
+    if status == health.STATUS_DOWN:
+        led_off()
+    else:
+        led_on()
+
+health_monitor = health.HealthMonitor(
+    metrics_file=HEALTH_METRICS_FILE,
+    on_state_change=show_health_on_led,
+)
+
+def hub_connection_changed(connected):
+    health_monitor.set_connected("hub", connected)
+    if connected:
+        led_on()
+        startup.mark_ready("hub")
+    else:
+        led_off()
+
+async def announce(entry):
+    txn = entry["txn"]
+    print(f"Transaction Alert (relay #{entry['seq']}): Credited amount = INR {txn['amount']} on {txn['date']} at {txn['time']}")
+    await asyncio.to_thread(speak_text, entry["speech"]) # Keeps the loop free to answer pings
+    await blink_led()
+
+async def speaker_main():
+    print(f"Connecting to relay hub: {RELAY_HUB_URL}")
+
+    speaker_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, speaker_task.cancel)
+
+    health_monitor.set_connected("hub", False)
+    health_task = asyncio.create_task(health_monitor.run())
+    client = relay.SpeakerClient(RELAY_HUB_URL, SPEAKER_STATE_FILE, on_connection_change=hub_connection_changed)
+    try:
+        await client.run(announce)
+    except asyncio.CancelledError:
+        print("\nReceived termination signal. Shutting down...")
+    finally:
+        health_monitor.stop()
+        health_task.cancel()
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    if not RELAY_HUB_URL:
+        print("ERROR: GHOSHIKA_RELAY_HUB_URL is not set.")
+        print(f"Please set it to the hub's address, e.g. GHOSHIKA_RELAY_HUB_URL=ws://<hub-ip>:{relay.RELAY_DEFAULT_PORT}")
+        raise SystemExit(1)
+    startup.warm_up(*WARM_UP_MODULES)
+    setup_gpio()
+    try:
+        asyncio.run(speaker_main())
+    except Exception as e:
+        print(f"Unhandled exception in main: {e}")
+    finally:
+        print("INFO: Shutting down. Turning LED OFF and cleaning up resources.")
+        led_off() # Ensure LED is off before cleanup
+        cleanup_gpio()
+        if os.path.exists(AUDIO_FILENAME):
+            try:
+                os.remove(AUDIO_FILENAME)
+                print(f"Cleaned up temporary audio file: {AUDIO_FILENAME}")
+            except Exception as e:
+                print(f"Error cleaning up temporary audio file {AUDIO_FILENAME} on exit: {e}")
+        print("Listener stopped.")
@@ -0,0 +1,231 @@
+import asyncio
+import collections
+import json
+import os
+import threading
+import time
+
+# Hub/speaker fan-out over the LAN.
+#
+# One node (the hub) runs a source listener as usual and additionally serves a
+# local websocket. Every parsed transaction gets a sequence number and is pushed
+# to all connected speakers, which only run TTS/playback (main_speaker.py).
+#
+# Protocol (JSON text frames):
+#   speaker -> hub  {"type": "subscribe", "epoch": <last epoch or null>, "since": <last seq or null>}
+#   hub -> speaker  {"type": "hello", "epoch": <epoch>, "seq": <latest seq>}
+#   hub -> speaker  {"type": "txn", "epoch": ..., "seq": n, "ts": ..., "txn": {...}, "speech": "..."}
+#
+# The epoch changes whenever the hub restarts (sequence numbers start over). On
+# subscribe the hub replays missed backlog entries:
+#   - same epoch: everything after "since"
+#   - different epoch: everything since the hub restarted
+#   - no epoch (first start of a speaker): nothing
+# Entries older than RELAY_CATCHUP_MAX_AGE_SECONDS are never replayed.
+
+RELAY_DEFAULT_PORT = 8765
+RELAY_DEFAULT_HOST = "0.0.0.0" # All interfaces; there is no authentication, see GHOSHIKA_RELAY_HUB_HOST
+RELAY_BACKLOG_SIZE = 100
+RELAY_CATCHUP_MAX_AGE_SECONDS = 600  # Don't announce payments that are more than 10 minutes old
+RELAY_SUBSCRIBE_TIMEOUT_SECONDS = 10
+RELAY_PING_INTERVAL_SECONDS = 10
+RELAY_PING_TIMEOUT_SECONDS = 5
+RELAY_RECONNECT_DELAY_SECONDS = 3
+
+class RelayHub:
+    """Broadcasts parsed transactions to speaker nodes. publish() may be called from any thread."""
+
+    def __init__(self, port=RELAY_DEFAULT_PORT, host=RELAY_DEFAULT_HOST):
+        self.host = host
+        self.port = port
+        self.epoch = str(time.time_ns())
+        self.seq = 0
+        self._backlog = collections.deque(maxlen=RELAY_BACKLOG_SIZE)
+        self._lock = threading.Lock()
+        self._speakers = set()  # One asyncio.Queue per connected speaker
+        self._loop = None
+
+    def publish(self, txn, speech_message):
+        with self._lock:
+            self.seq += 1
+            entry = {
+                "type": "txn",
+                "epoch": self.epoch,
+                "seq": self.seq,
+                "ts": time.time(),
+                "txn": txn,
+                "speech": speech_message,
+            }
+            self._backlog.append(entry)
+        print(f"INFO: Relaying transaction #{entry['seq']} to {len(self._speakers)} speaker(s).")
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._fan_out, json.dumps(entry))
+
+    def _fan_out(self, payload):
+        for queue in self._speakers:
+            queue.put_nowait(payload)
+
+    def _catch_up(self, subscribe):
+        # Caller holds self._lock
+        epoch = subscribe.get("epoch")
+        if epoch is None:
+            return []
+        since = (subscribe.get("since") or 0) if epoch == self.epoch else 0
+        oldest_ts = time.time() - RELAY_CATCHUP_MAX_AGE_SECONDS
+        return [json.dumps(entry) for entry in self._backlog if entry["seq"] > since and entry["ts"] >= oldest_ts]
+
+    async def _handle_speaker(self, websocket):
+        peer = websocket.remote_address
+        try:
+            subscribe = json.loads(await asyncio.wait_for(websocket.recv(), RELAY_SUBSCRIBE_TIMEOUT_SECONDS))
+        except Exception as e:
+            print(f"WARNING: Speaker {peer} failed to subscribe: {e}")
+            return
+
+        # The hello seq, the catch-up entries and the registration all come from one
+        # locked snapshot, taken before any await. Anything published after it is fanned
+        # out to this queue (fan-out runs on this loop, so after we return to it), and
+        # anything before it is either in the catch-up or covered by the hello seq.
+        # Overlap is dropped by the speaker using the sequence number.
+        queue = asyncio.Queue()
+        with self._lock:
+            hello = json.dumps({"type": "hello", "epoch": self.epoch, "seq": self.seq})
+            missed = self._catch_up(subscribe)
+        for payload in missed:
+            queue.put_nowait(payload)
+        self._speakers.add(queue)
+
+        closed = asyncio.ensure_future(websocket.wait_closed())
+        try:
+            await websocket.send(hello)
+            print(f"INFO: Speaker {peer} connected ({len(missed)} missed transaction(s) to replay).")
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                await websocket.send(getter.result())
+        except Exception as e:
+            print(f"WARNING: Lost speaker {peer}: {e}")
+        finally:
+            self._speakers.discard(queue)
+            closed.cancel()
+            print(f"INFO: Speaker {peer} disconnected.")
+
+    async def serve(self):
+        """Serves speakers until cancelled."""
+        import websockets
+        self._loop = asyncio.get_running_loop()
+        try:
+            async with websockets.serve(
+                self._handle_speaker,
+                self.host,
+                self.port,
+                ping_interval=RELAY_PING_INTERVAL_SECONDS,
+                ping_timeout=RELAY_PING_TIMEOUT_SECONDS,
+            ):
+                print(f"INFO: Relay hub listening on ws://{self.host}:{self.port} (epoch {self.epoch}).")
+                await asyncio.Future()
+        except OSError as e:
+            # The local listener keeps working; only the fan-out is lost
+            print(f"ERROR: Relay hub could not listen on port {self.port}: {e}. Speakers will not receive alerts.")
+
+def hub_from_env():
+    """
+    Returns a RelayHub if GHOSHIKA_RELAY_HUB_PORT is set, otherwise None.
+    GHOSHIKA_RELAY_HUB_HOST picks the interface to bind (default: all).
+    An invalid port is reported and ignored so the local listener still starts.
+    """
+    port_value = os.environ.get("GHOSHIKA_RELAY_HUB_PORT")
+    if not port_value:
+        return None
+    port = int(port_value) if port_value.strip().isdigit() else 0
+    if not 1 <= port <= 65535:
+        print(f"ERROR: Invalid GHOSHIKA_RELAY_HUB_PORT '{port_value}' (expected 1-65535). Relay hub disabled.")
+        return None
+    return RelayHub(port, os.environ.get("GHOSHIKA_RELAY_HUB_HOST") or RELAY_DEFAULT_HOST)
+
+class SpeakerClient:
+    """
+    Subscribes to a RelayHub and hands each new transaction to on_transaction (a coroutine function),
+    reconnecting forever. The last epoch/seq is kept in state_file so catch-up also works across restarts.
+    """
+
+    def __init__(self, hub_url, state_file=None, on_connection_change=None):
+        self.hub_url = hub_url
+        self.state_file = state_file
+        self.on_connection_change = on_connection_change
+        self.epoch = None
+        self.seq = None
+        self._load_state()
+
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file) as state_file:
+                state = json.load(state_file)
+            self.epoch, self.seq = state.get("epoch"), state.get("seq")
+        except Exception as e:
+            print(f"WARNING: Could not load speaker state from {self.state_file}: {e}")
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file, "w") as state_file:
+                json.dump({"epoch": self.epoch, "seq": self.seq}, state_file)
+        except Exception as e:
+            print(f"ERROR: Failed to save speaker state to {self.state_file}: {e}")
+
+    def _connection_changed(self, connected):
+        if self.on_connection_change:
+            self.on_connection_change(connected)
+
+    async def _receive(self, websocket, on_transaction):
+        await websocket.send(json.dumps({"type": "subscribe", "epoch": self.epoch, "since": self.seq}))
+        hello = json.loads(await asyncio.wait_for(websocket.recv(), RELAY_SUBSCRIBE_TIMEOUT_SECONDS))
+        if hello.get("epoch") != self.epoch:
+            if self.epoch is None:
+                # First start: only announce what arrives from now on
+                self.seq = hello.get("seq", 0)
+            else:
+                # Hub restarted: it replays everything since its restart
+                print("INFO: Hub restarted since last connection. Sequence numbers reset.")
+                self.seq = 0
+            self.epoch = hello.get("epoch")
+            self._save_state()
+        print(f"INFO: Subscribed to hub at {self.hub_url} (epoch {self.epoch}, last seq {self.seq}).")
+        self._connection_changed(True)
+
+        async for frame in websocket:
+            entry = json.loads(frame)
+            if entry.get("type") != "txn" or entry.get("epoch") != self.epoch:
+                continue
+            if entry["seq"] <= self.seq:
+                continue  # Already announced (catch-up overlap)
+            if entry["seq"] > self.seq + 1:
+                print(f"WARNING: Missing transactions #{self.seq + 1}-#{entry['seq'] - 1} from hub (older than catch-up window?).")
+            self.seq = entry["seq"]
+            self._save_state()
+            await on_transaction(entry)
+
+    async def run(self, on_transaction):
+        import websockets
+        while True:
+            try:
+                async with websockets.connect(
+                    self.hub_url,
+                    ping_interval=RELAY_PING_INTERVAL_SECONDS,
+                    ping_timeout=RELAY_PING_TIMEOUT_SECONDS,
+                    open_timeout=RELAY_SUBSCRIBE_TIMEOUT_SECONDS,
+                ) as websocket:
+                    await self._receive(websocket, on_transaction)
+                print(f"WARNING: Hub closed the connection. Reconnecting in {RELAY_RECONNECT_DELAY_SECONDS} seconds...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERROR: Relay connection to {self.hub_url} failed: {e}. Reconnecting in {RELAY_RECONNECT_DELAY_SECONDS} seconds...")
+            self._connection_changed(False)
+            await asyncio.sleep(RELAY_RECONNECT_DELAY_SECONDS)
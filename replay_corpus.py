@@ -0,0 +1,123 @@
+import argparse
+import importlib
+import json
+import time
+
+import corpus
+
+# Replays a corpus captured with GHOSHIKA_CAPTURE_FILE through the same parsing
+# code the listeners use and checks the extracted amounts and timings against
+# what was recorded live. Nothing is fetched from Gmail or ntfy.
+#
+#   python replay_corpus.py corpus_gmail.jsonl.gz            # as fast as possible
+#   python replay_corpus.py corpus_ntfy.jsonl.gz --speed 1   # original pacing
+#   python replay_corpus.py corpus_gmail.jsonl.gz --speak    # also run TTS/playback
+
+SOURCE_MODULES = {
+    "gmail": "main_gmail_poll",
+    "ntfy": "main_ntfy_pub_sub",
+}
+
+# Replay must never touch live accounts or the running daemon's files
+REPLAY_AUDIO_FILENAME = "temp_speech_replay.mp3"
+SPEAK_OPTIONS = {
+    "gmail": {"audio_filename": REPLAY_AUDIO_FILENAME, "alert_on_failure": False}, # No 'Failed to speak' to ntfy
+    "ntfy": {"audio_filename": REPLAY_AUDIO_FILENAME},
+}
+
+_loaded_modules = {}
+
+def get_source_module(source):
+    # Imported on first use so a gmail-only corpus does not need the ntfy dependencies and vice versa.
+    if source not in _loaded_modules:
+        _loaded_modules[source] = importlib.import_module(SOURCE_MODULES[source])
+    return _loaded_modules[source]
+
+def extract_text(module, record):
+    """Returns the alert text for a record, or None if the record is not a transaction alert."""
+    if record["source"] == "gmail":
+        payload = record.get("payload")
+        return module.get_email_body(payload) if payload else None
+
+    message = json.loads(record["frame"])
+    if not module.get_transaction_attachment(message):
+        return None
+    return record.get("attachment")
+
+def replay(filename, speed=0.0, speak=False, verbose=False):
+    """Replays the corpus. Returns the number of mismatches."""
+    stats = {"records": 0, "alerts": 0, "parsed": 0, "matched": 0, "mismatched": 0, "skipped": 0}
+    parse_seconds = 0.0
+    previous_ts = None
+    started = time.perf_counter()
+
+    for record in corpus.read_records(filename):
+        source = record.get("source")
+        if source not in SOURCE_MODULES:
+            print(f"WARNING: Skipping record with unknown source: {source}")
+            stats["skipped"] += 1
+            continue
+
+        ts = record.get("ts")
+        if speed > 0 and previous_ts is not None and ts is not None:
+            delay = (ts - previous_ts) / speed
+            if delay > 0:
+                time.sleep(delay)
+        previous_ts = ts
+
+        module = get_source_module(source)
+        stats["records"] += 1
+
+        parse_started = time.perf_counter()
+        try:
+            text = extract_text(module, record)
+            txn = module.parse_transaction(text) if text else None
+        except Exception as e:
+            print(f"ERROR: Failed to parse record {stats['records']} ({source}): {e}")
+            text, txn = None, None
+        parse_seconds += time.perf_counter() - parse_started
+
+        if text:
+            stats["alerts"] += 1
+        if txn:
+            stats["parsed"] += 1
+
+        expected = record.get("expected")
+        actual = corpus.expected_from_txn(txn)
+        if actual == expected:
+            stats["matched"] += 1
+        else:
+            stats["mismatched"] += 1
+            print(f"MISMATCH: record {stats['records']} ({source}, id={record.get('id')}): expected {expected}, got {actual}")
+
+        if txn:
+            speech_message = module.speech_message_for(txn)
+            if verbose:
+                print(f"INFO: {source}: INR {txn['amount']} on {txn['date']} at {txn['time']} -> \"{speech_message}\"")
+            if speak:
+                module.speak_text(speech_message, **SPEAK_OPTIONS[source])
+
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {stats['records']} record(s) from {filename} in {elapsed:.3f}s "
+          f"({stats['skipped']} skipped)")
+    print(f"Alerts: {stats['alerts']}, parsed: {stats['parsed']}, "
+          f"matched: {stats['matched']}, mismatched: {stats['mismatched']}")
+    if stats["records"] and parse_seconds > 0:
+        print(f"Parse throughput: {stats['records'] / parse_seconds:,.0f} records/s "
+              f"({parse_seconds / stats['records'] * 1e6:.1f} us/record)")
+    return stats["mismatched"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured ghoshika corpus through the parsers.")
+    parser.add_argument("corpus_file", help="gzip JSONL corpus written with GHOSHIKA_CAPTURE_FILE")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="playback speed relative to capture time (1 = real time, 0 = as fast as possible)")
+    parser.add_argument("--speak", action="store_true", help="run text-to-speech and playback for each parsed alert")
+    parser.add_argument("--verbose", action="store_true", help="print every parsed transaction")
+    args = parser.parse_args()
+
+    mismatches = replay(args.corpus_file, speed=args.speed, speak=args.speak, verbose=args.verbose)
+    raise SystemExit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import importlib
+import os
+import socket
+import threading
+import time
+
+# Taken as early as possible: the listeners import this module before anything heavy.
+PROCESS_START_TIME = time.monotonic()
+
+_ready_reported = False
+
+def run_in_background(target, *args, name=None):
+    """Runs target(*args) on a daemon thread so startup never waits on it."""
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+    return thread
+
+def _warm_module(module_name):
+    started = time.monotonic()
+    try:
+        importlib.import_module(module_name)
+        print(f"INFO: Warmed up {module_name} in {time.monotonic() - started:.2f}s.")
+    except Exception as e:
+        print(f"WARNING: Failed to warm up {module_name}: {e}")
+
+def warm_up(*module_names):
+    """
+    Imports the given modules concurrently in the background.
+    Later `import` statements for them return immediately (or wait for the in-flight import).
+    """
+    for module_name in module_names:
+        run_in_background(_warm_module, module_name, name=f"warm-{module_name}")
+
+def sd_notify(state):
+    """Sends a state string to systemd if running under a Type=notify unit. Returns True if sent."""
+    notify_socket = os.environ.get("NOTIFY_SOCKET")
+    if not notify_socket:
+        return False
+    if notify_socket.startswith("@"):
+        notify_socket = "\0" + notify_socket[1:]  # Abstract namespace socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(notify_socket)
+            sock.sendall(state.encode("utf-8"))
+        return True
+    except Exception as e:
+        print(f"WARNING: Failed to notify systemd ({state!r}): {e}")
+        return False
+
+def seconds_since_start():
+    return time.monotonic() - PROCESS_START_TIME
+
+def mark_ready(source_name):
+    """Reports readiness once, when the first source starts listening."""
+    global _ready_reported
+    if _ready_reported:
+        return
+    _ready_reported = True
+    time_to_ready = seconds_since_start()
+    print(f"INFO: Ready in {time_to_ready:.2f}s ({source_name} listening).")
+    sd_notify(f"READY=1\nSTATUS=Listening on {source_name} (ready in {time_to_ready:.2f}s)")